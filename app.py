@@ -1,10 +1,30 @@
 import streamlit as st
 import plotly.graph_objects as go
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import time
 import os
 from datetime import datetime
 import urllib.parse
+import contextlib
 import re
+import sys
+import json
+import hashlib
+import threading
+import mmap
+import array
+import tempfile
+import socket
+import fcntl
+import http.server
+import urllib.request
+import ssl
+import collections
+import concurrent.futures
+import itertools
+import math
+import uuid
 
 # ==========================================
 # 1. デザイン設定 (CSS injection)
@@ -496,29 +516,313 @@ QUESTIONS = [
     {"id": 35, "text": "ベッドメイキング（布団を整えること）は？", "axis": "IV", "options": {"A": "毎朝のルーティン", "B": "夜どうせ寝るからそのままでいい"}},
 ]
 
+# ==========================================
+# 2-2. コンテンツ管理 (ホットリロード)
+# ==========================================
+# TYPES / QUESTIONS は既定値。CONTENT_PATH に JSON ({"types": {...}, "questions": [...]}) を置くと
+# その内容で上書きする。BANKS_DIR/<名前>.json ({"questions": [...], "phase_bounds": [...]}) は
+# 別の質問バンクとして読み込み、?bank=<名前> で選べる。
+# 変更はバックグラウンドで検証・再構築してから丸ごと差し替える（再起動不要）。
+
+CONTENT_PATH = os.environ.get("ROOM_CONTENT_PATH", "content.json")
+BANKS_DIR = os.environ.get("ROOM_BANKS_DIR", "banks")
+CONTENT_POLL_SEC = 2.0
+
+# calculate_result が集計する軸
+AXES = ("I", "II", "III", "IV")
+# 既定バンクの PHASE 2〜4 の開始位置
+PHASE_BOUNDS = (9, 18, 27)
+TYPE_FIELDS = ("title", "copy", "desc", "color")
+QUESTION_FIELDS = ("id", "text", "axis", "options")
+AXIS_LABELS = {"I": '物量(Mini)', "II": '機能(Func)', "III": 'モダン(Sharp)', "IV": '幾帳面(Perf)'}
+
+def split_description(desc):
+    """説明文を「導入文」と「詳細（もっと見る）」に分割する"""
+    full_text_cleaned = clean_text_for_markdown(desc)
+    split_index = full_text_cleaned.find("<h4>")
+    if split_index != -1:
+        return full_text_cleaned[:split_index], full_text_cleaned[split_index:]
+    return full_text_cleaned, ""
+
+def validate_content(types, questions):
+    """コンテンツの整合性を検査し、問題点のリストを返す（空ならOK）"""
+    return validate_types(types) + validate_questions(questions)
+
+def validate_types(types):
+    """タイプ：既定の16キーが過不足なく揃っていること（共有リンク・画像名がキーに依存するため）"""
+    errors = []
+    if not isinstance(types, dict):
+        return ["types は辞書である必要があります"]
+    for key in sorted(set(TYPES) - set(types)):
+        errors.append(f"タイプ {key} がありません")
+    for key in sorted(set(types) - set(TYPES)):
+        errors.append(f"未知のタイプ {key}")
+    for key, data in types.items():
+        if not isinstance(data, dict):
+            errors.append(f"タイプ {key} の形式が不正です")
+            continue
+        for field in TYPE_FIELDS:
+            if not isinstance(data.get(field), str) or not data.get(field):
+                errors.append(f"タイプ {key} の {field} がありません")
+        if not re.fullmatch(r"#[0-9a-fA-F]{6}", str(data.get("color", ""))):
+            errors.append(f"タイプ {key} の color は #RRGGBB 形式にしてください")
+    return errors
+
+def validate_questions(questions, phase_bounds=None):
+    """質問：calculate_result の軸と一致し、すべての軸に1問以上あること"""
+    errors = []
+    if not isinstance(questions, list):
+        return ["questions はリストである必要があります"]
+    seen_ids = set()
+    for i, q in enumerate(questions):
+        if not isinstance(q, dict) or any(field not in q for field in QUESTION_FIELDS):
+            errors.append(f"質問 {i + 1} に必須項目がありません")
+            continue
+        if not isinstance(q["id"], int) or isinstance(q["id"], bool):
+            errors.append(f"質問 {i + 1} の id は整数にしてください")
+            continue
+        if q["id"] in seen_ids:
+            errors.append(f"質問ID {q['id']} が重複しています")
+        seen_ids.add(q["id"])
+        if not isinstance(q["text"], str) or not q["text"]:
+            errors.append(f"質問ID {q['id']} の text がありません")
+        if q["axis"] not in AXES:
+            errors.append(f"質問ID {q['id']} の軸 {q['axis']} は未知です")
+        if (not isinstance(q["options"], dict) or set(q["options"]) != {"A", "B"}
+                or not all(isinstance(v, str) for v in q["options"].values())):
+            errors.append(f"質問ID {q['id']} の選択肢は A / B の2つ（文字列）にしてください")
+    for axis in AXES:
+        if not any(isinstance(q, dict) and q.get("axis") == axis for q in questions):
+            errors.append(f"軸 {axis} の質問がありません")
+    if phase_bounds is not None:
+        if (not isinstance(phase_bounds, list) or len(phase_bounds) != 3
+                or not all(isinstance(b, int) for b in phase_bounds)
+                or not 0 < phase_bounds[0] < phase_bounds[1] < phase_bounds[2] < len(questions)):
+            errors.append("phase_bounds は質問数未満の昇順の整数3つにしてください")
+    return errors
+
+def build_content_bundle(types, questions, source, banks=None):
+    """検証済みコンテンツから派生テーブルを作り、1つのバンドルにまとめる（以後は変更しない）"""
+    plans = {DEFAULT_BANK: get_scoring_plan(questions, None, types)}
+    for name, bank in (banks or {}).items():
+        plans[name] = get_scoring_plan(bank["questions"], bank.get("phase_bounds"), types)
+
+    digest = hashlib.sha256(
+        json.dumps(
+            {"types": types, "banks": {name: plan.hash for name, plan in plans.items()}},
+            sort_keys=True, ensure_ascii=False,
+        ).encode("utf-8")
+    ).hexdigest()
+
+    types_out = {}
+    for key, data in types.items():
+        intro, detail = split_description(data["desc"])
+        types_out[key] = {**data, "intro": intro, "detail": detail}
+
+    return {
+        "version": digest[:12],
+        "source": source,
+        "types": types_out,
+        "banks": plans,
+    }
+
+def load_banks(banks_dir):
+    """banks_dir/<名前>.json の質問バンクを読み込んで検証する"""
+    banks = {}
+    if not os.path.isdir(banks_dir):
+        return banks
+    for file_name in sorted(os.listdir(banks_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        name = file_name[:-len(".json")]
+        with open(os.path.join(banks_dir, file_name), encoding="utf-8") as f:
+            data = json.load(f)
+        if name == DEFAULT_BANK:
+            raise ValueError(f"バンク名 {DEFAULT_BANK} は既定の質問セット用に予約されています")
+        if not isinstance(data, dict):
+            raise ValueError(f"バンク {name}: トップレベルは {{\"questions\": ...}} の形式にしてください")
+        errors = validate_questions(data.get("questions"), data.get("phase_bounds"))
+        if errors:
+            raise ValueError(f"バンク {name}: " + " / ".join(errors))
+        banks[name] = data
+    return banks
+
+def load_content(path, banks_dir=BANKS_DIR):
+    """path のJSONと質問バンクを読み込み、検証済みのバンドルを返す。ファイルが無ければ既定値を使う"""
+    types, questions, source = TYPES, QUESTIONS, "builtin"
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("トップレベルは {\"types\": ..., \"questions\": ...} の形式にしてください")
+        types = data.get("types", TYPES)
+        questions = data.get("questions", QUESTIONS)
+        source = path
+
+    errors = validate_content(types, questions)
+    if errors:
+        raise ValueError(" / ".join(errors))
+    return build_content_bundle(types, questions, source, load_banks(banks_dir))
+
+def _content_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _content_signature(store):
+    """監視対象（コンテンツ + 質問バンク）の (パス, 更新時刻) の一覧"""
+    paths = [store["path"]]
+    try:
+        paths += sorted(os.path.join(store["banks_dir"], n) for n in os.listdir(store["banks_dir"]) if n.endswith(".json"))
+    except OSError:
+        pass
+    return tuple((path, _content_mtime(path)) for path in paths)
+
+def reload_content(store):
+    """コンテンツが変わっていれば再構築して差し替える。不正な内容なら現行版を維持する"""
+    mtime = _content_signature(store)
+    if mtime == store["mtime"]:
+        return False
+    try:
+        bundle = load_content(store["path"], store["banks_dir"])
+    except Exception as e:
+        # 想定外の例外でも監視スレッドと配信中の版は止めない
+        store["mtime"] = mtime
+        store["error"] = str(e)
+        print(f"[content] 再読み込みに失敗したため現行版を継続します: {e}", file=sys.stderr)
+        return False
+
+    # 参照の付け替え1回で差し替える（読み手はロック不要）
+    with store["lock"]:
+        store["bundle"] = bundle
+        store["mtime"] = mtime
+        store["error"] = None
+    # 古い版のプランは、それを固定しているセッションだけが保持する
+    prune_plan_cache({plan.hash for plan in bundle["banks"].values()})
+    return True
+
+def _watch_content(store):
+    while True:
+        time.sleep(CONTENT_POLL_SEC)
+        try:
+            reload_content(store)
+        except Exception as e:
+            print(f"[content] 監視中にエラーが発生しました: {e!r}", file=sys.stderr)
+
+@st.cache_resource
+def get_content_store():
+    """プロセス共有のコンテンツストア。初回呼び出しで監視スレッドを起動する"""
+    store = {
+        "path": CONTENT_PATH, "banks_dir": BANKS_DIR,
+        "bundle": None, "mtime": None, "error": None, "lock": threading.Lock(),
+    }
+    reload_content(store)
+    if store["bundle"] is None:
+        # 起動時点でファイルが不正なら既定値で起動し、修正を待つ
+        store["bundle"] = build_content_bundle(TYPES, QUESTIONS, "builtin")
+    threading.Thread(target=_watch_content, args=(store,), daemon=True, name="content-watcher").start()
+    return store
+
 # ==========================================
 # 3. ロジック関数
 # ==========================================
 
-def calculate_result(answers):
-    scores = {"I": 0, "II": 0, "III": 0, "IV": 0}
+# --- 質問バンクと採点プラン ---
+# 質問バンクごとに、採点に使う表（質問→軸、フェーズ境界、符号の組→タイプ）を一度だけ作った
+# 不変の「プラン」にコンパイルし、内容のハッシュでキャッシュする。
+# 採点はプランの表を引くだけなので、読み込んだバンクの数に依存しない。
+
+DEFAULT_BANK = "default"
+
+ScoringPlan = collections.namedtuple(
+    "ScoringPlan", ["hash", "version", "scale_key", "questions", "axis_of", "phase_bounds", "type_table"]
+)
+
+def derive_phase_bounds(questions):
+    """PHASE 2〜4 の開始位置。軸ごとにまとまっていれば軸の切れ目、そうでなければ4等分"""
+    axes = [q["axis"] for q in questions]
+    if axes == sorted(axes, key=AXES.index):
+        return tuple(axes.index(axis) for axis in AXES[1:])
+    n = len(questions)
+    return (n // 4, n // 2, n * 3 // 4)
+
+def scoring_plan_hash(questions, phase_bounds, types):
+    return hashlib.sha256(
+        json.dumps(
+            {"questions": list(questions), "phase_bounds": phase_bounds, "types": sorted(types)},
+            sort_keys=True, ensure_ascii=False,
+        ).encode("utf-8")
+    ).hexdigest()
+
+def compile_scoring_plan(questions, phase_bounds=None, types=TYPES, digest=None):
+    """検証済みの質問リストを採点プランにコンパイルする"""
+    digest = digest or scoring_plan_hash(questions, phase_bounds, types)
+    # ビット pos が立っている = 軸 AXES[pos] のスコアが負
+    type_table = tuple(
+        _resolve_type_key({axis: -1 if mask >> pos & 1 else 0 for pos, axis in enumerate(AXES)}, types)
+        for mask in range(1 << len(AXES))
+    )
+    # 軸スコアの尺度は「どの質問がどの軸か」だけで決まる（文言の修正では変わらない）
+    scale_key = hashlib.sha256(
+        json.dumps(sorted([q["id"], q["axis"]] for q in questions)).encode("utf-8")
+    ).hexdigest()[:12]
+    return ScoringPlan(
+        hash=digest,
+        version=digest[:12],
+        scale_key=scale_key,
+        questions=tuple(questions),
+        axis_of={q["id"]: AXES.index(q["axis"]) for q in questions},
+        phase_bounds=tuple(phase_bounds or derive_phase_bounds(questions)),
+        type_table=type_table,
+    )
+
+@st.cache_resource
+def get_plan_cache():
+    return {"plans": {}, "lock": threading.Lock()}
+
+def get_scoring_plan(questions, phase_bounds=None, types=TYPES):
+    """内容のハッシュが同じなら、コンパイル済みのプランを使い回す"""
+    digest = scoring_plan_hash(questions, phase_bounds, types)
+    cache = get_plan_cache()
+    with cache["lock"]:
+        plan = cache["plans"].get(digest)
+        if plan is None:
+            plan = cache["plans"][digest] = compile_scoring_plan(questions, phase_bounds, types, digest)
+    return plan
+
+def prune_plan_cache(keep_hashes):
+    cache = get_plan_cache()
+    with cache["lock"]:
+        for digest in set(cache["plans"]) - set(keep_hashes):
+            del cache["plans"][digest]
+
+def calculate_result(answers, plan):
+    totals = [0] * len(AXES)
     for q_id, choice in answers.items():
-        question = next((q for q in QUESTIONS if q["id"] == q_id), None)
-        if question:
-            if choice == "A": scores[question["axis"]] += 1
-            else: scores[question["axis"]] -= 1
-    
+        pos = plan.axis_of.get(q_id)
+        if pos is not None:
+            if choice == "A": totals[pos] += 1
+            else: totals[pos] -= 1
+
+    mask = 0
+    for pos, total in enumerate(totals):
+        if total < 0: mask |= 1 << pos
+    return plan.type_table[mask], dict(zip(AXES, totals))
+
+def _resolve_type_key(scores, types):
+    """軸スコアの符号からタイプキーを決める（採点プランの表はこの規則で作る）"""
     c1 = "M" if scores["I"] >= 0 else "C"
     c2 = "S" if scores["III"] >= 0 else "W"
     c3 = "F" if scores["II"] >= 0 else "E"
     c4 = "P" if scores["IV"] >= 0 else "L"
     
     final_key = c1 + c3 + c2 + c4
-    if final_key not in TYPES:
+    if final_key not in types:
         alt_key = c1 + c2 + c3 + c4 
-        final_key = alt_key if alt_key in TYPES else "MFSP"
+        final_key = alt_key if alt_key in types else "MFSP"
             
-    return final_key, scores
+    return final_key
 
 def create_radar_chart(scores, color_hex):
     val_i = 5 + (scores["I"] * 0.5)
@@ -526,7 +830,7 @@ def create_radar_chart(scores, color_hex):
     val_iii = 5 + (scores["III"] * 0.5)
     val_iv = 5 + (scores["IV"] * 0.5)
     
-    categories = ['物量(Mini)', '機能(Func)', 'モダン(Sharp)', '幾帳面(Perf)']
+    categories = [AXIS_LABELS[axis] for axis in AXES]
     values = [val_i, val_ii, val_iii, val_iv]
     categories.append(categories[0])
     values.append(values[0])
@@ -561,6 +865,143 @@ def create_radar_chart(scores, color_hex):
     )
     return fig
 
+@st.cache_resource(max_entries=512, show_spinner=False)
+def get_radar_chart(score_values, color_hex):
+    """(AXES 順の軸スコア, 色) ごとにチャートをキャッシュする。図はセッション間で共有するので変更しない"""
+    return create_radar_chart(dict(zip(AXES, score_values)), color_hex)
+
+# ==========================================
+# 3-2. 母集団統計 (軸ごとのパーセンタイル)
+# ==========================================
+# 軸スコアごとの件数を固定長の整数ヒストグラムで持つ。質問バンクによって軸スコアの尺度が
+# 違うため、ヒストグラムはプランの scale_key ごとに STATS_DIR/<scale_key>/ に分ける。
+# プロセスごとにその下の
+# 専用ファイルを mmap して書き込み（書き手はプロセスに1つなのでプロセス間ロック不要）、
+# 読み取りは全ファイルを合算した一定間隔のスナップショットだけを参照する。
+# 終了したプロセスのファイルは、次に起動したプロセスが hist-base.bin に合算して削除するので、
+# ファイル数は「生きているプロセス数 + 1」に収まる。
+
+STATS_DIR = os.environ.get("ROOM_STATS_DIR", os.path.join(tempfile.gettempdir(), "room-diagnosis-stats"))
+HIST_MAX = 64                       # スコア範囲 [-HIST_MAX, HIST_MAX]（範囲外は端に丸める）
+HIST_BINS = 2 * HIST_MAX + 1
+HIST_BYTES = len(AXES) * HIST_BINS * 8
+STATS_SNAPSHOT_TTL = 30             # 秒
+HIST_BASE_NAME = "hist-base.bin"
+
+def _hist_bin(score):
+    return min(max(score, -HIST_MAX), HIST_MAX) + HIST_MAX
+
+def _read_histogram(path):
+    """ヒストグラムファイルを読む。無い・壊れている場合は None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(HIST_BYTES)
+    except OSError:
+        return None
+    return array.array("Q", data) if len(data) == HIST_BYTES else None
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _merge_dead_histograms(stats_dir):
+    """このホストで終了済みのプロセスのファイルを hist-base.bin に合算して削除する"""
+    # PIDの生死はホスト内でしか判定できないので、他ホストのファイルには触れない
+    prefix = f"hist-{socket.gethostname()}-"
+    with open(os.path.join(stats_dir, "merge.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = []
+        for name in os.listdir(stats_dir):
+            pid = name[len(prefix):-len(".bin")]
+            if name.startswith(prefix) and name.endswith(".bin") and pid.isdigit() and not _pid_alive(int(pid)):
+                dead.append(os.path.join(stats_dir, name))
+        if not dead:
+            return
+
+        base_path = os.path.join(stats_dir, HIST_BASE_NAME)
+        totals = _read_histogram(base_path) or array.array("Q", bytes(HIST_BYTES))
+        for path in dead:
+            for i, count in enumerate(_read_histogram(path) or ()):
+                totals[i] += count
+        tmp_path = base_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(totals.tobytes())
+        os.replace(tmp_path, base_path)
+        for path in dead:
+            os.remove(path)
+
+def _stats_dir(scale_key):
+    return os.path.join(STATS_DIR, scale_key)
+
+@st.cache_resource
+def get_local_histogram(scale_key):
+    """このプロセス専用のヒストグラム（uint64 × 軸数 × HIST_BINS）"""
+    stats_dir = _stats_dir(scale_key)
+    os.makedirs(stats_dir, exist_ok=True)
+    _merge_dead_histograms(stats_dir)
+    path = os.path.join(stats_dir, f"hist-{socket.gethostname()}-{os.getpid()}.bin")
+    with open(path, "a+b") as f:
+        if os.path.getsize(path) < HIST_BYTES:
+            f.truncate(HIST_BYTES)
+        buf = mmap.mmap(f.fileno(), HIST_BYTES)
+    return {"path": path, "buf": buf, "counts": memoryview(buf).cast("Q"), "lock": threading.Lock()}
+
+def record_population_scores(scores, plan):
+    """結果1件分の軸スコアを、そのプランの尺度のヒストグラムに加算する"""
+    hist = get_local_histogram(plan.scale_key)
+    # 同一プロセス内のセッション（スレッド）同士の加算だけを直列化する
+    with hist["lock"]:
+        for pos, axis in enumerate(AXES):
+            hist["counts"][pos * HIST_BINS + _hist_bin(scores[axis])] += 1
+
+def _sum_histograms(stats_dir):
+    """stats_dir の hist-*.bin をすべて合算する"""
+    totals = array.array("Q", bytes(HIST_BYTES))
+    if not os.path.isdir(stats_dir):
+        return totals
+    # 合算中（hist-base.bin の置き換え〜終了済みファイルの削除）に読むと二重に数えるので、
+    # merge.lock を共有ロックで取って合算と重ならないようにする
+    with open(os.path.join(stats_dir, "merge.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        for name in os.listdir(stats_dir):
+            if not (name.startswith("hist-") and name.endswith(".bin")):
+                continue
+            for i, count in enumerate(_read_histogram(os.path.join(stats_dir, name)) or ()):
+                totals[i] += count
+    return totals
+
+@st.cache_resource(ttl=STATS_SNAPSHOT_TTL, show_spinner=False)
+def load_population_snapshot(scale_key):
+    """全プロセスのヒストグラムを合算し、軸ごとの「ビン → パーセンタイル」表を作る（読み取り専用で共有）"""
+    totals = _sum_histograms(_stats_dir(scale_key))
+
+    snapshot = {}
+    for pos, axis in enumerate(AXES):
+        counts = totals[pos * HIST_BINS:(pos + 1) * HIST_BINS]
+        n = sum(counts)
+        table = []
+        below = 0
+        for count in counts:
+            # 中間順位：自分より下の人数 + 同点の半分
+            table.append((below + count / 2) / n * 100 if n else None)
+            below += count
+        snapshot[axis] = {"n": n, "percentiles": table}
+    return snapshot
+
+def get_axis_percentiles(scores, plan):
+    """同じ尺度のプランで診断した人の中での各軸のパーセンタイル（0〜100）。母集団が空なら空の辞書"""
+    snapshot = load_population_snapshot(plan.scale_key)
+    return {
+        axis: snapshot[axis]["percentiles"][_hist_bin(scores[axis])]
+        for axis in AXES
+        if snapshot[axis]["n"]
+    }
+
 # ==========================================
 # 4. アプリケーション本体 (ディープリンク対応版)
 # ==========================================
@@ -578,23 +1019,23 @@ def clean_text_for_markdown(text):
     text = re.sub(r'\s+', ' ', text)
     return text.strip()
 
-def get_phase_info(q_index):
-    """現在の質問番号(0始まり)から、フェーズ情報とカラーを取得する"""
-    if q_index < 9:
+def get_phase_info(q_index, phase_bounds=PHASE_BOUNDS):
+    """現在の質問番号(0始まり)から、フェーズ情報とカラーを取得する（phase_bounds は質問バンクごと）"""
+    if q_index < phase_bounds[0]:
         return {
             "name": "PHASE 1", 
             "color_start": "#4facfe", # 水色
             "color_end": "#00f2fe",
             "theme": "cyan"
         }
-    elif q_index < 18:
+    elif q_index < phase_bounds[1]:
         return {
             "name": "PHASE 2", 
             "color_start": "#43e97b", # 緑
             "color_end": "#38f9d7",
             "theme": "green"
         }
-    elif q_index < 27:
+    elif q_index < phase_bounds[2]:
         return {
             "name": "PHASE 3", 
             "color_start": "#fa709a", # オレンジ〜ピンク
@@ -609,8 +1050,406 @@ def get_phase_info(q_index):
             "theme": "purple"
         }
 
+# ==========================================
+# 4-2. 送信ペイロード計測
+# ==========================================
+# ROOM_PAYLOAD_PROFILE に出力先(JSONL)を指定すると、1回の描画ごとに
+# ページ名と要素ごとの送信バイト数(ForwardMsg)を1行で追記する。
+# 集計・予算チェックは tools/payload_report.py で行う。
+
+PAYLOAD_PROFILE_PATH = os.environ.get("ROOM_PAYLOAD_PROFILE")
+
+# 1回の描画で送る合計バイト数の上限（ページ単位）。
+# tools/payload_report.py の計測値 + 約25%（内容やスタイルの変更で増えたら見直す）
+PAYLOAD_BUDGETS = {
+    "home": 14_500,           # 計測 11,449
+    "quiz": 13_500,           # 計測 約10,500（各フェーズ）
+    "result": 26_500,         # 計測 20,974
+    "shared_result": 21_500,  # 計測 17,122
+    "history": 12_000,        # 計測 9,705（履歴1件）
+}
+
+def page_label(page, q_index, phase_bounds=PHASE_BOUNDS):
+    """計測用のページ名。診断画面はフェーズごとに分ける"""
+    if page == 'quiz':
+        return f"quiz:{get_phase_info(q_index, phase_bounds)['name']}"
+    return page
+
+def _payload_element_name(msg):
+    kind = msg.WhichOneof("type")
+    if kind != "delta":
+        return kind
+    delta_kind = msg.delta.WhichOneof("type")
+    if delta_kind != "new_element":
+        return delta_kind
+    element = msg.delta.new_element
+    element_kind = element.WhichOneof("type")
+    if element_kind == "markdown":
+        # 同じ markdown 同士を区別できるよう先頭を付ける
+        return f"markdown:{clean_text_for_markdown(element.markdown.body)[:24]}"
+    return element_kind
+
+@contextlib.contextmanager
+def profile_payload(label):
+    """ブロック内で送信されたメッセージのサイズを記録する（計測無効時は何もしない）"""
+    ctx = get_script_run_ctx() if PAYLOAD_PROFILE_PATH else None
+    if ctx is None:
+        yield
+        return
+
+    records = []
+    original_enqueue = ctx._enqueue
+
+    def enqueue(msg):
+        records.append((_payload_element_name(msg), msg.ByteSize()))
+        original_enqueue(msg)
+
+    ctx._enqueue = enqueue
+    complete = False
+    try:
+        yield
+        complete = True
+    finally:
+        # st.rerun() 等で中断された描画は complete=False として残す
+        ctx._enqueue = original_enqueue
+        line = json.dumps(
+            {"t": round(time.time(), 3), "page": label, "complete": complete, "elements": records},
+            ensure_ascii=False,
+        )
+        with open(PAYLOAD_PROFILE_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+# ==========================================
+# 4-3. ウォームアップと readiness
+# ==========================================
+# プロセス起動時に初回コスト（Plotly の初回描画・説明文の整形・画像の読み込み）を
+# 先に払っておく。ROOM_READY_PORT を指定すると GET /ready で準備状況を返す
+# （準備中は 503、ウォームアップが終わり、かつ Streamlit サーバーが /_stcore/health に
+# 応答するようになってから 200）。ロードバランサはこれを待ってから振り分ける。
+# 同じポートの GET /stats で運用向けの集計値を返す。
+# readiness を使う場合のエントリポイントは `python app.py [streamlit run の引数...]`。
+# `streamlit run app.py` では最初のセッションが来るまで何も起動しないため、
+# ROOM_READY_PORT を指定したままそちらで起動するとエラーにする。
+
+READY_HOST = os.environ.get("ROOM_READY_HOST", "0.0.0.0")
+READY_PORT = int(os.environ.get("ROOM_READY_PORT", "0"))
+# `python app.py` で起動したプロセスに付ける目印
+LAUNCHER_ENV = "ROOM_LAUNCHER"
+
+@st.cache_resource
+def _read_image_file(image_path, mtime):
+    with open(image_path, "rb") as f:
+        return f.read()
+
+def load_image_bytes(type_key):
+    """assets/ のタイプ画像を読み込む（無ければ None）"""
+    image_path = f"assets/{type_key}.png"
+    # 「無い」ことはキャッシュしない（起動後に追加・差し替えた画像も再起動なしで出す）
+    try:
+        mtime = os.path.getmtime(image_path)
+    except OSError:
+        return None
+    return _read_image_file(image_path, mtime)
+
+def run_warmup(readiness):
+    try:
+        content = get_content_store()["bundle"]
+        # 全バンク・全質問ぶんのフェーズ情報（PHASE 1〜4）
+        for plan in content["banks"].values():
+            for q_index in range(len(plan.questions)):
+                get_phase_info(q_index, plan.phase_bounds)
+        for type_key in content["types"]:
+            load_image_bytes(type_key)
+        # Plotly の初回 import・検証・シリアライズだけを温める。
+        # 実際の結果で使わないスコアの図を共有キャッシュに入れないよう get_radar_chart は通さない
+        create_radar_chart({axis: 0 for axis in AXES}, "#667eea").to_json()
+        for plan in content["banks"].values():
+            load_population_snapshot(plan.scale_key)
+    except Exception as e:
+        # ウォームアップの失敗で配信を止めない（初回アクセスが遅くなるだけ）
+        readiness["error"] = repr(e)
+        print(f"[warmup] 失敗しました: {e!r}", file=sys.stderr)
+    finally:
+        readiness["finished"] = time.time()
+        readiness["warmed"] = True
+
+def _streamlit_health_url():
+    """このプロセスで動く Streamlit サーバーのヘルスチェックURL（起動引数で決まった設定から組み立てる）"""
+    from streamlit import config
+
+    host = config.get_option("server.address") or "127.0.0.1"
+    if host in ("0.0.0.0", "::"):
+        host = "127.0.0.1"
+    scheme = "https" if config.get_option("server.sslCertFile") else "http"
+    base = (config.get_option("server.baseUrlPath") or "").strip("/")
+    path = f"/{base}/_stcore/health" if base else "/_stcore/health"
+    return f"{scheme}://{host}:{config.get_option('server.port')}{path}"
+
+def _streamlit_serving():
+    try:
+        # 自分自身への問い合わせなので自己署名証明書でも通す
+        with urllib.request.urlopen(_streamlit_health_url(), timeout=1,
+                                    context=ssl._create_unverified_context()) as res:
+            return res.status == 200
+    except (OSError, ValueError):
+        return False
+
+def _readiness_route(readiness):
+    # ウォームアップはサーバーの listen より先に終わり得るので、サーバー側の応答も確かめる。
+    # 一度応答すれば以降は問い合わせない
+    if readiness["warmed"] and not readiness["serving"]:
+        readiness["serving"] = _streamlit_serving()
+    readiness["ready"] = readiness["warmed"] and readiness["serving"]
+    return (200 if readiness["ready"] else 503), readiness
+
+def start_readiness_server(routes, host, port):
+    """routes: {パス: () -> (ステータス, JSON化できる値)} を返すだけの小さなHTTPサーバー"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes.get(self.path.split("?")[0])
+            status, payload = route() if route else (404, {"error": "not found"})
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="readiness-server").start()
+    return server
+
+@st.cache_resource
+def start_warmup():
+    """ウォームアップをバックグラウンドで1回だけ開始し、準備状況の辞書を返す"""
+    if READY_PORT and os.environ.get(LAUNCHER_ENV) != "1":
+        message = "ROOM_READY_PORT を使う場合は `python app.py` で起動してください（streamlit run では最初のセッションまで /ready が起動しません）"
+        print(f"[warmup] {message}", file=sys.stderr)
+        raise RuntimeError(message)
+
+    readiness = {"ready": False, "warmed": False, "serving": False,
+                 "started": time.time(), "finished": None, "error": None}
+    if READY_PORT:
+        routes = {
+            "/ready": lambda: _readiness_route(readiness),
+            "/stats": lambda: (200, {"sessions": get_session_memory_stats()}),
+        }
+        start_readiness_server(routes, READY_HOST, READY_PORT)
+    threading.Thread(target=run_warmup, args=(readiness,), daemon=True, name="warmup").start()
+    return readiness
+
+# ==========================================
+# 4-4. セッションメモリ管理
+# ==========================================
+# セッションごとの概算メモリを測り、履歴は固定長の (分単位の時刻, タイプキー) に詰めて
+# HISTORY_LIMIT 件までに制限する。結果表示のまま SESSION_IDLE_TIMEOUT 秒放置された
+# セッションは、もう使わない回答データを破棄する。集計値は GET /stats で返す。
+
+HISTORY_LIMIT = 20
+SESSION_IDLE_TIMEOUT = int(os.environ.get("ROOM_SESSION_IDLE_TIMEOUT", "600"))
+SESSION_SWEEP_SEC = 60
+# 全セッション共有のため計測しないキー
+SHARED_SESSION_KEYS = ("content", "plan")
+
+def estimate_bytes(obj, _seen=None):
+    """コンテナを辿って sys.getsizeof を合計した概算バイト数"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_bytes(k, seen) + estimate_bytes(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_bytes(v, seen) for v in obj)
+    return size
+
+def append_history(type_key):
+    """履歴の先頭に1件追加し、HISTORY_LIMIT 件を超えた古いものを捨てる"""
+    history = st.session_state.history
+    history.insert(0, (int(time.time() // 60), type_key))
+    del history[HISTORY_LIMIT:]
+
+def _session_state_of(session_id):
+    """Runtime のセッション管理から、セッションが続く限り同じ SessionState を引く（終了済みなら None）"""
+    # ctx.session_state は実行ごとに作り直されるラッパーなので、生死の判定には使えない
+    session_info = Runtime.instance()._session_mgr.get_session_info(session_id)
+    return session_info.session.session_state if session_info else None
+
+def _sweep_sessions(registry):
+    while True:
+        time.sleep(SESSION_SWEEP_SEC)
+        # AppTest やベアモードでは Runtime が無く、生死を判定できないので何もしない
+        if not Runtime.exists():
+            continue
+        now = time.time()
+        with registry["lock"]:
+            entries = list(registry["sessions"].items())
+        for session_id, entry in entries:
+            state = _session_state_of(session_id)
+            if state is None:
+                # セッション終了済み
+                with registry["lock"]:
+                    registry["sessions"].pop(session_id, None)
+                continue
+            if entry["compacted"] or now - entry["last_active"] < SESSION_IDLE_TIMEOUT:
+                continue
+            try:
+                if state["page"] == 'quiz':
+                    continue  # 回答途中のセッションは戻ってくる可能性があるので残す
+                answers = state["answers"]
+                if answers:
+                    state["answers"] = {}
+                    entry["bytes"] -= estimate_bytes(answers)
+                entry["compacted"] = True
+            except KeyError:
+                continue
+
+@st.cache_resource
+def get_session_registry():
+    """プロセス内の全セッションの {session_id: 計測値} と、アイドル掃除スレッド"""
+    registry = {"sessions": {}, "lock": threading.Lock()}
+    threading.Thread(target=_sweep_sessions, args=(registry,), daemon=True, name="session-sweeper").start()
+    return registry
+
+def track_session():
+    """現在のセッションの最終操作時刻と概算メモリを記録する"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    state = {k: v for k, v in st.session_state.to_dict().items() if k not in SHARED_SESSION_KEYS}
+    registry = get_session_registry()
+    with registry["lock"]:
+        registry["sessions"][ctx.session_id] = {
+            "last_active": time.time(),
+            "bytes": estimate_bytes(state),
+            "compacted": False,
+        }
+
+def get_session_memory_stats():
+    """レプリカのサイジング用に、セッションメモリの集計値を返す"""
+    registry = get_session_registry()
+    with registry["lock"]:
+        entries = list(registry["sessions"].values())
+    sizes = [entry["bytes"] for entry in entries]
+    return {
+        "sessions": len(entries),
+        "idle_compacted": sum(1 for entry in entries if entry["compacted"]),
+        "total_bytes": sum(sizes),
+        "avg_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+        "max_bytes": max(sizes, default=0),
+    }
+
+# ==========================================
+# 4-5. 結果の先読み
+# ==========================================
+# 最終フェーズでは残りの回答で変わりうる軸が限られ、到達しうる結果は数通りしかない。
+# 回答中にその候補の画像とレーダーチャートをバックグラウンドで用意しておき、
+# 結果画面は温まったキャッシュから描画する（説明文の整形はコンテンツ読み込み時に済んでいる）。
+
+PREFETCH_MAX_CHARTS = 16
+
+def predict_final_results(plan, answers):
+    """未回答の質問がどう答えられても到達しうる (タイプキー, 最終スコア) の一覧。多すぎれば空"""
+    totals = [0] * len(AXES)
+    remaining = [0] * len(AXES)
+    for q in plan.questions:
+        pos = plan.axis_of[q["id"]]
+        choice = answers.get(q["id"])
+        if choice is None: remaining[pos] += 1
+        elif choice == "A": totals[pos] += 1
+        else: totals[pos] -= 1
+
+    # 残り r 問の軸は r+1 通りの最終スコアを取りうる
+    finals = [range(total - r, total + r + 1, 2) for total, r in zip(totals, remaining)]
+    if math.prod(len(f) for f in finals) > PREFETCH_MAX_CHARTS:
+        return []
+    results = []
+    for final in itertools.product(*finals):
+        mask = 0
+        for pos, total in enumerate(final):
+            if total < 0: mask |= 1 << pos
+        results.append((plan.type_table[mask], final))
+    return results
+
+def _prefetch_results(candidates, types):
+    try:
+        for type_key, final in candidates:
+            load_image_bytes(type_key)
+            get_radar_chart(final, types[type_key]["color"])
+    except Exception as e:
+        print(f"[prefetch] 失敗しました: {e!r}", file=sys.stderr)
+
+@st.cache_resource
+def get_prefetch_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+def prefetch_result_candidates(plan, content, answers):
+    """最終フェーズの回答中に呼ぶ。候補の結果アセットの準備を投げて、すぐ戻る"""
+    candidates = predict_final_results(plan, answers)
+    if candidates:
+        get_prefetch_executor().submit(_prefetch_results, candidates, content["types"])
+
+# ==========================================
+# 4-6. セッショントレース記録
+# ==========================================
+# ROOM_TRACE_PATH を指定したときだけ、セッションごとの操作（ページ遷移・回答・戻る）を
+# 匿名化して JSONL に追記する（パス中の {pid} はプロセスIDに置き換える）。
+# 1行1イベント: [トレースID, セッション開始からのミリ秒, イベント名, 値]
+# トレースIDはセッションごとの乱数で、ユーザーやブラウザを特定する情報は残さない。
+# 書き込みはバッファに積んでバックグラウンドでまとめて行う。再生は tools/replay.py で行う。
+
+TRACE_PATH = os.environ.get("ROOM_TRACE_PATH")
+TRACE_FLUSH_SEC = 1.0
+
+def _flush_traces(writer):
+    while True:
+        time.sleep(TRACE_FLUSH_SEC)
+        with writer["lock"]:
+            lines, writer["buffer"] = writer["buffer"], []
+        if lines:
+            with open(writer["path"], "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+
+@st.cache_resource
+def get_trace_writer():
+    writer = {"path": TRACE_PATH.format(pid=os.getpid()), "buffer": [], "lock": threading.Lock()}
+    threading.Thread(target=_flush_traces, args=(writer,), daemon=True, name="trace-writer").start()
+    return writer
+
+def trace_event(event, value=None):
+    """現在のセッションのイベントを1件記録する（記録無効時は何もしない）"""
+    if not TRACE_PATH:
+        return
+    if 'trace_id' not in st.session_state:
+        st.session_state.trace_id = uuid.uuid4().hex[:12]
+        st.session_state.trace_start = time.time()
+    elapsed_ms = int((time.time() - st.session_state.trace_start) * 1000)
+    line = json.dumps([st.session_state.trace_id, elapsed_ms, event, value], ensure_ascii=False, separators=(",", ":"))
+    writer = get_trace_writer()
+    with writer["lock"]:
+        writer["buffer"].append(line + "\n")
+
+def trace_page_view():
+    """セッション開始と、前回の描画からのページ遷移を記録する"""
+    if not TRACE_PATH:
+        return
+    if 'trace_id' not in st.session_state:
+        trace_event("start", {
+            "at": int(time.time()),
+            "page": st.session_state.page,
+            "id": st.session_state.get('shared_id'),
+            "bank": st.session_state.bank,
+        })
+    if st.session_state.get('trace_page') != st.session_state.page:
+        st.session_state.trace_page = st.session_state.page
+        trace_event("page", st.session_state.page)
+
 # ★移動：定義をmainの前に持ってくる
-def show_result_content(type_key, result_data, scores=None, is_shared_view=False):
+def show_result_content(type_key, result_data, scores=None, is_shared_view=False, plan=None):
     """結果画面の中身を表示する共通関数"""
     
     st.markdown(f"""
@@ -623,24 +1462,16 @@ def show_result_content(type_key, result_data, scores=None, is_shared_view=False
     st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
 
     image_path = f"assets/{type_key}.png"
-    if os.path.exists(image_path):
-        st.image(image_path, use_container_width=True)
+    image_bytes = load_image_bytes(type_key)
+    if image_bytes:
+        st.image(image_bytes, use_container_width=True)
     else:
         st.warning(f"画像が見つかりません: {image_path}")
         st.image(f"https://placehold.co/800x500/{result_data['color'].replace('#','')}/FFFFFF?text={result_data['title']}", use_container_width=True)
     
-    # --- 説明文の分割表示ロジック ---
-    full_text_cleaned = clean_text_for_markdown(result_data['desc'])
-    
-    split_marker = "<h4>"
-    split_index = full_text_cleaned.find(split_marker)
-    
-    if split_index != -1:
-        intro_text = full_text_cleaned[:split_index]
-        detail_text = full_text_cleaned[split_index:]
-    else:
-        intro_text = full_text_cleaned
-        detail_text = ""
+    # --- 説明文の分割表示（分割済みテーブルはコンテンツ読み込み時に作成） ---
+    intro_text = result_data['intro']
+    detail_text = result_data['detail']
 
     # 1. 導入文
     intro_html = f"<div class='result-copy'>{clean_text_for_markdown(result_data['copy'])}</div><div class='result-desc-box'><div class='result-desc'>{intro_text}</div></div>"
@@ -654,8 +1485,13 @@ def show_result_content(type_key, result_data, scores=None, is_shared_view=False
     
     if scores:
         st.markdown('### <span class="gradient-text-cool">📊 部屋の成分表</span>', unsafe_allow_html=True)
-        chart = create_radar_chart(scores, result_data['color'])
+        chart = get_radar_chart(tuple(scores[axis] for axis in AXES), result_data['color'])
         st.plotly_chart(chart, use_container_width=True)
+
+        percentiles = get_axis_percentiles(scores, plan) if plan else {}
+        if percentiles:
+            ranks = " ・ ".join(f"{AXIS_LABELS[axis]} 上位{max(1, round(100 - p))}%" for axis, p in percentiles.items())
+            st.markdown(f"<div style='text-align: center; color: #888; font-size: 12px;'>みんなと比べると：{ranks}</div>", unsafe_allow_html=True)
     
     # SNSシェアセクション
     base_url = "https://room-diagnosis.streamlit.app"
@@ -702,12 +1538,15 @@ def show_result_content(type_key, result_data, scores=None, is_shared_view=False
 def main():
     st.set_page_config(page_title="Room Type Diagnosis", page_icon="🏠", layout="centered")
     
+    start_warmup()
+    content_store = get_content_store()
+
     # セッションの初期化
     if 'page' not in st.session_state: 
         # Deep Linking check
         query_params = st.query_params
         shared_id = query_params.get("id", None)
-        if shared_id and shared_id in TYPES:
+        if shared_id and shared_id in content_store["bundle"]["types"]:
             st.session_state.page = 'shared_result'
             st.session_state.shared_id = shared_id
         else:
@@ -716,9 +1555,27 @@ def main():
     if 'answers' not in st.session_state: st.session_state.answers = {}
     if 'current_q_index' not in st.session_state: st.session_state.current_q_index = 0
     if 'history' not in st.session_state: st.session_state.history = []
+    if 'bank' not in st.session_state: st.session_state.bank = st.query_params.get("bank", DEFAULT_BANK)
+
+    # コンテンツ版と質問バンクの固定：診断中・結果表示中のセッションは開始時の版を最後まで使う
+    if 'content' not in st.session_state or st.session_state.page in ('home', 'history'):
+        st.session_state.content = content_store["bundle"]
+        banks = st.session_state.content["banks"]
+        st.session_state.plan = banks.get(st.session_state.bank, banks[DEFAULT_BANK])
+    content = st.session_state.content
+    plan = st.session_state.plan
+    track_session()
+    trace_page_view()
+
+    with profile_payload(page_label(st.session_state.page, st.session_state.current_q_index, plan.phase_bounds)):
+        render_page(content, plan)
+
+def render_page(content, plan):
+    """現在のページを描画する"""
+    questions = plan.questions
 
     # フェーズ情報の取得とCSS適用
-    current_phase = get_phase_info(st.session_state.current_q_index)
+    current_phase = get_phase_info(st.session_state.current_q_index, plan.phase_bounds)
     apply_custom_style(current_phase if st.session_state.page == 'quiz' else None)
 
     # --- 画面遷移 ---
@@ -768,18 +1625,22 @@ def main():
 
     # B. 診断画面
     elif st.session_state.page == 'quiz':
-        progress = (st.session_state.current_q_index + 1) / len(QUESTIONS)
+        progress = (st.session_state.current_q_index + 1) / len(questions)
         st.progress(progress)
         
-        q_data = QUESTIONS[st.session_state.current_q_index]
-        phase = get_phase_info(st.session_state.current_q_index)
+        q_data = questions[st.session_state.current_q_index]
+        phase = get_phase_info(st.session_state.current_q_index, plan.phase_bounds)
+
+        # 最終フェーズでは結果の候補を先読みする
+        if st.session_state.current_q_index >= plan.phase_bounds[-1]:
+            prefetch_result_candidates(plan, content, st.session_state.answers)
         
         # フェーズバッジの表示
         st.markdown(f"<div style='text-align:center;'><span class='phase-badge'>{phase['name']}</span></div>", unsafe_allow_html=True)
         
         st.markdown(f"""
         <div class='question-card'>
-            <div class='question-number'>QUESTION {st.session_state.current_q_index + 1} / {len(QUESTIONS)}</div>
+            <div class='question-number'>QUESTION {st.session_state.current_q_index + 1} / {len(questions)}</div>
             <div class='question-text'>{q_data['text']}</div>
         </div>
         """, unsafe_allow_html=True)
@@ -788,35 +1649,38 @@ def main():
         with col1:
             if st.button(f"🅰️ {q_data['options']['A']}", type="secondary", use_container_width=True, key=f"q{q_data['id']}_a"):
                 st.session_state.answers[q_data['id']] = "A"
+                trace_event("answer", [q_data['id'], "A"])
                 next_question()
         with col2:
             if st.button(f"🅱️ {q_data['options']['B']}", type="secondary", use_container_width=True, key=f"q{q_data['id']}_b"):
                 st.session_state.answers[q_data['id']] = "B"
+                trace_event("answer", [q_data['id'], "B"])
                 next_question()
         
         st.markdown("<div style='margin-top: 30px; text-align: center;'>", unsafe_allow_html=True)
         if st.session_state.current_q_index > 0:
             if st.button("戻る", use_container_width=False):
+                trace_event("back", st.session_state.current_q_index)
                 st.session_state.current_q_index -= 1
                 st.rerun()
 
     # C. 結果画面 (診断直後)
     elif st.session_state.page == 'result':
-        type_key, scores = calculate_result(st.session_state.answers)
-        result_data = TYPES[type_key]
-        
-        # 履歴保存
-        if not any(d['date'] == st.session_state.get('last_run') for d in st.session_state.history):
-             run_time = datetime.now().strftime("%Y/%m/%d %H:%M")
-             st.session_state.history.insert(0, {"date": run_time, "type": type_key, "title": result_data['title']})
-             st.session_state.last_run = run_time
+        # 診断結果は確定時に1回だけ計算済み（放置後に回答データを破棄しても表示できる）
+        type_key, scores = st.session_state.result
+        result_data = content["types"][type_key]
+
+        # 母集団統計への加算と履歴保存（結果1件につき1回）
+        if st.session_state.pop('pending_record', False):
+            record_population_scores(scores, plan)
+            append_history(type_key)
 
-        show_result_content(type_key, result_data, scores) # 結果表示の共通関数を呼び出し
+        show_result_content(type_key, result_data, scores, plan=plan) # 結果表示の共通関数を呼び出し
 
     # D. 共有された結果画面 (クイズせずに見る画面)
     elif st.session_state.page == 'shared_result':
         type_key = st.session_state.shared_id
-        result_data = TYPES[type_key]
+        result_data = content["types"][type_key]
         
         st.info("💡 シェアされた診断結果を表示しています")
         show_result_content(type_key, result_data, None, is_shared_view=True)
@@ -828,12 +1692,13 @@ def main():
         if not st.session_state.history:
             st.info("まだ履歴がありません")
         else:
-            for item in st.session_state.history:
+            for minute, type_key in st.session_state.history:
+                run_time = datetime.fromtimestamp(minute * 60).strftime("%Y/%m/%d %H:%M")
                 st.markdown(f"""
                 <div style='background: white; padding: 15px; border-radius: 10px; margin-bottom: 10px; border-left: 5px solid #ddd; box-shadow: 0 2px 5px rgba(0,0,0,0.05);'>
-                    <small style='color: #999'>{item['date']}</small><br>
-                    <b style='font-size: 18px; color: #333'>{item['title']}</b>
-                    <span style='float: right; color: #aaa'>#{item['type']}</span>
+                    <small style='color: #999'>{run_time}</small><br>
+                    <b style='font-size: 18px; color: #333'>{content["types"][type_key]['title']}</b>
+                    <span style='float: right; color: #aaa'>#{type_key}</span>
                 </div>
                 """, unsafe_allow_html=True)
         
@@ -842,14 +1707,24 @@ def main():
             st.rerun()
 
 def next_question():
-    if st.session_state.current_q_index < len(QUESTIONS) - 1:
+    if st.session_state.current_q_index < len(st.session_state.plan.questions) - 1:
         st.session_state.current_q_index += 1
         st.rerun()
     else:
         with st.spinner('Analying...'):
             time.sleep(1.0) 
+        st.session_state.result = calculate_result(st.session_state.answers, st.session_state.plan)
+        st.session_state.pending_record = True
         st.session_state.page = 'result'
         st.rerun()
 
 if __name__ == "__main__":
-    main()
+    if get_script_run_ctx() is not None:
+        main()
+    else:
+        # `python app.py [streamlit の引数...]` で起動した場合：サーバーより先にウォームアップを始める
+        os.environ[LAUNCHER_ENV] = "1"
+        start_warmup()
+        from streamlit.web import cli as stcli
+        sys.argv = ["streamlit", "run", os.path.abspath(__file__), *sys.argv[1:]]
+        sys.exit(stcli.main())
@@ -0,0 +1,130 @@
+"""送信ペイロードのランキングと予算チェック
+
+app.py の各ページ（home / quiz の各フェーズ / result / shared_result / history）を
+AppTest で描画し、ROOM_PAYLOAD_PROFILE に記録された要素ごとの送信バイト数を集計する。
+ページ合計が PAYLOAD_BUDGETS を超えたら終了コード 1 を返す（デプロイ前のチェック用）。
+
+    python tools/payload_report.py                    # 全ページを描画して計測
+    python tools/payload_report.py --input prof.jsonl # 本番等で記録済みのログを集計
+    python tools/payload_report.py --budget result=120000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+sys.path.insert(0, ROOT)
+
+
+def _click(at, label):
+    next(b for b in at.button if b.label == label).click().run()
+
+
+def drive_pages(runs):
+    """全ページ分岐を runs 回ずつ描画する（計測は app.py 側で追記される）"""
+    from streamlit.testing.v1 import AppTest
+
+    for _ in range(runs):
+        at = AppTest.from_file(APP_PATH, default_timeout=60)
+        at.run()
+        _click(at, "📜 過去の履歴を見る")
+        _click(at, "戻る")
+        _click(at, "診断をスタートする →")
+        for i, q in enumerate(at.session_state["plan"].questions):
+            at.button(key=f"q{q['id']}_{'a' if i % 2 == 0 else 'b'}").click().run()
+        _click(at, "🏠 トップへ戻る")
+        _click(at, "📜 過去の履歴を見る")
+
+        shared = AppTest.from_file(APP_PATH, default_timeout=60)
+        shared.query_params["id"] = "MFSP"
+        shared.run()
+
+
+def load_profile(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    """(ページ, 要素) ごとのバイト数と、ページごとの1描画あたり合計を集める"""
+    per_element = defaultdict(list)
+    page_totals = defaultdict(list)
+    for record in records:
+        # st.rerun で中断された描画は合計に含めない
+        if not record.get("complete", True):
+            continue
+        sums = defaultdict(int)
+        for name, size in record["elements"]:
+            sums[name] += size
+        for name, size in sums.items():
+            per_element[(record["page"], name)].append(size)
+        page_totals[record["page"]].append(sum(sums.values()))
+    return per_element, page_totals
+
+
+def check_budgets(page_totals, budgets):
+    """予算超過したページの (ページ, 最大バイト数, 予算) のリストを返す"""
+    violations = []
+    for page, totals in sorted(page_totals.items()):
+        budget = budgets.get(page.split(":")[0])
+        if budget is not None and max(totals) > budget:
+            violations.append((page, max(totals), budget))
+    return violations
+
+
+def print_report(per_element, page_totals, budgets, top):
+    print("== 要素ランキング（1描画あたり平均バイト） ==")
+    ranked = sorted(per_element.items(), key=lambda item: -sum(item[1]) / len(item[1]))
+    for (page, name), sizes in ranked[:top]:
+        print(f"{sum(sizes) / len(sizes):>10,.0f}  {page:<16} {name}")
+
+    print()
+    print("== ページ合計 / 予算 ==")
+    for page, totals in sorted(page_totals.items()):
+        budget = budgets.get(page.split(":")[0])
+        status = "-" if budget is None else ("OK" if max(totals) <= budget else "OVER")
+        budget_text = "-" if budget is None else f"{budget:,}"
+        print(f"{page:<16} max {max(totals):>10,} / {budget_text:>10}  {status}")
+
+
+def main(argv=None):
+    from app import PAYLOAD_BUDGETS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", help="集計する記録済みの JSONL（省略時は全ページを描画して計測）")
+    parser.add_argument("--runs", type=int, default=1, help="各ページを描画する回数")
+    parser.add_argument("--top", type=int, default=20, help="ランキングの表示件数")
+    parser.add_argument("--budget", action="append", default=[], metavar="PAGE=BYTES", help="予算の上書き")
+    args = parser.parse_args(argv)
+
+    budgets = dict(PAYLOAD_BUDGETS)
+    for item in args.budget:
+        page, _, size = item.partition("=")
+        budgets[page] = int(size)
+
+    if args.input:
+        records = load_profile(args.input)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "payload.jsonl")
+            os.environ["ROOM_PAYLOAD_PROFILE"] = path
+            # 計測用の診断結果で母集団統計を汚さない
+            os.environ["ROOM_STATS_DIR"] = os.path.join(tmp, "stats")
+            drive_pages(args.runs)
+            records = load_profile(path)
+
+    per_element, page_totals = summarize(records)
+    print_report(per_element, page_totals, budgets, args.top)
+
+    violations = check_budgets(page_totals, budgets)
+    for page, size, budget in violations:
+        print(f"予算超過: {page} {size:,} > {budget:,}", file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""記録したセッショントレースの加速再生（キャパシティ計画用）
+
+app.py が ROOM_TRACE_PATH に記録したトレースを読み込み、セッションごとに AppTest で
+同じ操作（ページ遷移・回答・戻る・共有リンクからの来訪）を再現する。
+セッションの到着間隔と操作間の待ち時間は --speed 倍に縮め、同時に走らせるセッション数は
+--concurrency で制限する。終了後に操作ごとの応答時間と、CPU時間・最大RSSを表示する。
+
+AppTest は実行のたびにプロセス全体で1つの Runtime を差し替えるため、同じプロセスで
+並行に動かすと互いの実行を壊す。そのため各セッションはワーカープロセス
+（最大 --concurrency 個）で1つずつ再生する。失敗した操作は、操作ごとに最初の例外を
+レポートの末尾に表示する。
+
+    python tools/replay.py traces.jsonl --speed 10 --concurrency 8
+
+AppTest はアプリをワーカープロセス内で直接実行するため、計測値は Streamlit サーバーの
+WebSocket 処理を含まない「スクリプト実行のコスト」である点に注意。
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+
+# (現在のページ, 遷移先) → 押すボタン
+TRANSITIONS = {
+    ("home", "history"): "📜 過去の履歴を見る",
+    ("history", "home"): "戻る",
+    ("home", "quiz"): "診断をスタートする →",
+    ("result", "home"): "🏠 トップへ戻る",
+    ("shared_result", "home"): "✨ 私も診断してみる",
+}
+
+
+def load_traces(path):
+    """トレースIDごとに、時刻順のイベント列 [(ミリ秒, イベント名, 値), ...] にまとめる"""
+    sessions = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                trace_id, elapsed_ms, event, value = json.loads(line)
+                sessions[trace_id].append((elapsed_ms, event, value))
+    traces = []
+    for events in sessions.values():
+        events.sort(key=lambda e: e[0])
+        start = next((value for _, event, value in events if event == "start"), None)
+        # 開始イベントが欠けた（記録開始前からの）セッションは再現できないので除く
+        if start is not None:
+            traces.append((start, events))
+    traces.sort(key=lambda trace: trace[0]["at"])
+    return traces
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.lags = []
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+
+    def add(self, action, seconds, lag):
+        self.latencies[action].append(seconds)
+        self.lags.append(lag)
+
+    def error(self, action, exc):
+        self.errors[action] += 1
+        # 全件失敗でも原因を追えるよう、操作ごとに最初の例外だけ残す
+        self.error_samples.setdefault(action, f"{type(exc).__name__}: {exc}")
+
+    def to_data(self):
+        """プロセス間で受け渡せる組み込み型だけの形にする"""
+        return dict(self.latencies), self.lags, dict(self.errors), self.error_samples
+
+    def merge_data(self, data):
+        """ワーカープロセスから返ってきた to_data() の値を合算する"""
+        latencies, lags, errors, error_samples = data
+        for action, values in latencies.items():
+            self.latencies[action].extend(values)
+        self.lags.extend(lags)
+        for action, count in errors.items():
+            self.errors[action] += count
+        for action, sample in error_samples.items():
+            self.error_samples.setdefault(action, sample)
+
+
+def _timed(stats, action, scheduled, func):
+    lag = max(0.0, time.monotonic() - scheduled)
+    started = time.monotonic()
+    try:
+        func()
+    except Exception as e:
+        stats.error(action, e)
+        return
+    stats.add(action, time.monotonic() - started, lag)
+
+
+def _page(at):
+    try:
+        return at.session_state["page"]
+    except KeyError:
+        return None
+
+
+def _click_label(at, label):
+    next(b for b in at.button if b.label == label).click().run()
+
+
+def replay_session(start, events, t0, speed):
+    """1セッション分のイベントを、t0 を起点に speed 倍速で再現する（ワーカープロセスで実行）
+
+    戻り値は Stats.to_data() の組み込み型。AppTest はアプリ実行時に sys.modules["__main__"] を
+    差し替えるため、このスクリプトのクラスをそのまま返すと親プロセスへの pickle に失敗する。
+    """
+    # 同じワーカーで次のセッションを受け取れるよう、終了時に元の __main__ へ戻す
+    main_module = sys.modules["__main__"]
+    try:
+        return _replay_events(start, events, t0, speed).to_data()
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+def _replay_events(start, events, t0, speed):
+    from streamlit.testing.v1 import AppTest
+
+    stats = Stats()
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    if start.get("id"):
+        at.query_params["id"] = start["id"]
+    if start.get("bank"):
+        at.query_params["bank"] = start["bank"]
+
+    for elapsed_ms, event, value in events:
+        scheduled = t0 + elapsed_ms / 1000 / speed
+        time.sleep(max(0.0, scheduled - time.monotonic()))
+
+        if event == "start":
+            _timed(stats, "open", scheduled, at.run)
+        elif event == "answer":
+            q_id, choice = value
+            key = f"q{q_id}_{choice.lower()}"
+            _timed(stats, "answer", scheduled, lambda: at.button(key=key).click().run())
+        elif event == "back":
+            _timed(stats, "back", scheduled, lambda: _click_label(at, "戻る"))
+        elif event == "page":
+            label = TRANSITIONS.get((_page(at), value))
+            # 回答の結果として遷移したページ（quiz → result など）は操作不要
+            if label is not None:
+                _timed(stats, f"page:{value}", scheduled, lambda: _click_label(at, label))
+    return stats
+
+
+def replay(traces, speed, concurrency):
+    stats = Stats()
+    first_at = traces[0][0]["at"]
+    futures = []
+    # time.monotonic はホスト内の全プロセスで共通の時計なので、予定時刻をそのまま渡せる
+    origin = time.monotonic()
+    with ProcessPoolExecutor(max_workers=concurrency) as pool:
+        for start, events in traces:
+            # 到着間隔も speed 倍に縮める
+            t0 = origin + (start["at"] - first_at) / speed
+            time.sleep(max(0.0, t0 - time.monotonic()))
+            futures.append(pool.submit(replay_session, start, events, t0, speed))
+        for future in futures:
+            try:
+                stats.merge_data(future.result())
+            except Exception as e:
+                stats.error("session", e)
+    return stats, time.monotonic() - origin
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def print_report(stats, traces, wall, speed, concurrency):
+    # 再生はワーカープロセスで行うので、終了済みの子プロセスの使用量を見る
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print(f"セッション {len(traces)} / イベント {sum(len(e) for _, e in traces)} / "
+          f"{speed:g}倍速・同時 {concurrency} / 経過 {wall:.1f}s")
+    print()
+    print(f"{'操作':<20}{'件数':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'失敗':>6}")
+    for action in sorted(set(stats.latencies) | set(stats.errors)):
+        values = stats.latencies.get(action, [])
+        if values:
+            p50, p95, top = (_percentile(values, 50) * 1000, _percentile(values, 95) * 1000, max(values) * 1000)
+            print(f"{action:<20}{len(values):>8}{p50:>10.0f}{p95:>10.0f}{top:>10.0f}{stats.errors[action]:>6}")
+        else:
+            print(f"{action:<20}{0:>8}{'-':>10}{'-':>10}{'-':>10}{stats.errors[action]:>6}")
+    print()
+    if stats.lags:
+        # 予定時刻からの遅れが伸びるなら、この速度・同時数では捌ききれていない
+        print(f"予定からの遅れ p95 {_percentile(stats.lags, 95) * 1000:.0f} ms / max {max(stats.lags) * 1000:.0f} ms")
+    print(f"CPU user {usage.ru_utime:.1f}s / sys {usage.ru_stime:.1f}s / "
+          f"ワーカー1プロセスの最大RSS {usage.ru_maxrss / 1024:.0f} MB")
+    if stats.error_samples:
+        print()
+        print("失敗例（操作ごとに最初の1件）")
+        for action, sample in sorted(stats.error_samples.items()):
+            print(f"  {action}: {sample}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="ROOM_TRACE_PATH で記録した JSONL")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（N倍速）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に再生するセッション数（ワーカープロセス数）の上限")
+    parser.add_argument("--limit", type=int, help="先頭から再生するセッション数")
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.trace)[:args.limit]
+    if not traces:
+        print("再生できるセッションがありません", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 再生中の操作を記録し直したり、母集団統計を汚したりしない
+        os.environ.pop("ROOM_TRACE_PATH", None)
+        os.environ["ROOM_STATS_DIR"] = os.path.join(tmp, "stats")
+        stats, wall = replay(traces, args.speed, args.concurrency)
+
+    print_report(stats, traces, wall, args.speed, args.concurrency)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())